@@ -1,6 +1,12 @@
 #! /usr/bin/env python3
 
-import curses, os, re, sys
+import curses, io, mmap, os, sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from difflib import SequenceMatcher
+from itertools import zip_longest
+from locale import getpreferredencoding
 from string import printable
 
 '''
@@ -25,6 +31,71 @@ from string import printable
 #sys.dont_write_bytecode = True # don't make the __pycache__ folder
 #from displays import showmenu, filemenu, drawsplitpane
 
+# these keys will quit: escape = 27, 'Q'=81, 'q'=113
+quitkeys = frozenset((27, 81, 113))
+# these keys will select a menu choice: enter, newline, carriage return
+enterkeys = frozenset((curses.KEY_ENTER, 10, 13))
+
+'''
+menuhome, menuend, menuup, menudown, menupageup, menupagedown
+
+  These are the navigation key handlers used by showmenu
+  hpos is the highlighted choice and topline is the first choice shown
+  actualtop is the screen row of topline and height is the screen height
+  nchoices is the number of choices
+
+  Returns -> the new hpos, topline
+'''
+# go to the top
+def menuhome(hpos, topline, actualtop, height, nchoices): return 0, 0
+
+# go to the bottom
+def menuend(hpos, topline, actualtop, height, nchoices):
+  if actualtop + nchoices > height:
+    topline = nchoices - height + actualtop
+    hpos = nchoices - 1
+  return hpos, topline
+
+# go up
+def menuup(hpos, topline, actualtop, height, nchoices):
+  if hpos > 0:
+    hpos -= 1
+    if actualtop + hpos - topline < actualtop: topline -= 1
+  return hpos, topline
+
+# go down
+def menudown(hpos, topline, actualtop, height, nchoices):
+  if hpos < nchoices - 1:
+    hpos += 1
+    if actualtop + hpos - topline == height: topline += 1
+  return hpos, topline
+
+# jump up
+def menupageup(hpos, topline, actualtop, height, nchoices):
+  if hpos > 0:
+    hpos -= 4
+    if hpos - topline < 0: topline = hpos
+    if hpos < 0:
+      hpos = 0
+      topline = 0
+  return hpos, topline
+
+# jump down
+def menupagedown(hpos, topline, actualtop, height, nchoices):
+  hpos += 4
+  if hpos >= nchoices - 1: hpos = nchoices - 1
+  if actualtop + hpos - topline >= height:
+    topline += actualtop + hpos - topline - height + 1
+  return hpos, topline
+
+# the showmenu key handlers, looked up by the key pressed
+menukeys = {curses.KEY_HOME: menuhome,
+            curses.KEY_END: menuend,
+            curses.KEY_UP: menuup,
+            curses.KEY_DOWN: menudown,
+            curses.KEY_PPAGE: menupageup,
+            curses.KEY_NPAGE: menupagedown}
+
 '''
 showmenu(scr, title, body, err, choices, infobox, curs, hpos)
 
@@ -48,28 +119,34 @@ showmenu(scr, title, body, err, choices, infobox, curs, hpos)
     0 is hidden
     1 is (possibly) an underscore/line
     2 is (possibly) a block
+  After a keypress the cursor is hidden and scr is set to leaveok(True)
 '''
 def showmenu(scr,
               title='', body=[[]], err=None, choices=[],
               infobox=False, curs=0, topline=0, hpos=0):
   if hpos < topline: hpos = topline
-  # track width
-  maxwidth = len(title)
-  for section in body:
-    for line in section: maxwidth = max(len(line),maxwidth)
+  # track width, this is computed once before the loop
+  maxwidth = max(len(title),
+                  max((len(line) for section in body for line in section),
+                      default=0),
+                  max(map(len, choices), default=0))
   errorlen = 1
   if type(err) is str: maxwidth = max(len(err),maxwidth)
   elif type(err) is list:
     errorlen = len(err)
-    for e in err: maxwidth = max(len(e),maxwidth)
-  for line in choices: maxwidth = max(len(line),maxwidth)
+    maxwidth = max(max(map(len, err), default=0),maxwidth)
   # set colors to be used
   titlecolor = curses.color_pair(2) | curses.A_BOLD
   itemcolor = curses.color_pair(1)
   activecolor = curses.color_pair(1) | curses.A_BOLD
   errorcolor = curses.color_pair(3) | curses.A_BOLD
+  # the number of choices doesn't change while the menu is shown
+  nchoices = len(choices)
   # when the counter hits zero make the error disappear
   errorcounter = None
+  # the topline, error, and dimensions of the last full draw
+  drawn = None
+  prevhpos = hpos
   while True:
     if err and errorcounter == 0:
       topline -= errorlen + 1
@@ -80,101 +157,119 @@ def showmenu(scr,
     # get side buffer
     lshift = 0
     if maxwidth < width: lshift = (width-maxwidth)//2
-    # clear the screen
-    scr.erase()
-    # add the title
-    scr.insstr(0, 0+lshift, title, titlecolor)
-    # track the line number we are printing to
-    linenum = 1
-    for section in body:
-      # print all lines in a section of the body
-      for line in section:
+    # when only hpos moved since the last full draw move the highlight
+    # the two choices are recolored with chgat, limited to ascii text
+    if nchoices and drawn == (topline, err, height, width) and \
+          choices[hpos].isascii() and choices[prevhpos].isascii():
+      scr.chgat(actualtop + prevhpos - topline, 4+lshift,
+                len(choices[prevhpos]), itemcolor)
+      scr.chgat(actualtop + hpos - topline, 4+lshift,
+                len(choices[hpos]), activecolor)
+      if err: errorcounter -= 1
+    else:
+      # clear the screen
+      scr.erase()
+      # add the title
+      scr.insstr(0, 0+lshift, title, titlecolor)
+      # track the line number we are printing to
+      linenum = 1
+      for section in body:
+        # print all lines in a section of the body
+        for line in section:
+          linenum += 1
+          scr.insstr(linenum, 4+lshift, line, itemcolor)
+        # separate body sections by a newline
         linenum += 1
-        scr.insstr(linenum, 4+lshift, line, itemcolor)
-      # separate body sections by a newline
+      # separate body from remainder with another newline
       linenum += 1
-    # separate body from remainder with another newline
-    linenum += 1
-    if err:
-      # print an error message if we have one, add 2 lines
-      if type(err) is list:
-        for e in err:
-          if e == '': continue
-          scr.insstr(linenum, 4+lshift, e, errorcolor)
+      if err:
+        # print an error message if we have one, add 2 lines
+        if type(err) is list:
+          for e in err:
+            if e == '': continue
+            scr.insstr(linenum, 4+lshift, e, errorcolor)
+            linenum += 1
+          linenum -= 1
+        else:
+          scr.insstr(linenum, 4+lshift, err, errorcolor)
+        linenum += 2
+        if errorcounter is None:
+          errorcounter = 5
+          if height-linenum < nchoices:
+            topline += errorlen + 1
+            # if the error pushes hpos out of sight
+            if topline > hpos: topline = hpos
+        else:
+          errorcounter -= 1
+      # track the actual top line of the choices
+      actualtop = linenum
+      # i is zero indexed matching hpos
+      for i, line in enumerate(choices):
+        # we cannot go beyond height if choices is a long list
+        if linenum == height: break
+        # print this line
+        if i >= topline:
+          # set the color to active if this is our highlight position
+          color = activecolor if i == hpos else itemcolor
+          scr.insstr(linenum, 4+lshift, line, color)
           linenum += 1
-        linenum -= 1
-      else:
-        scr.insstr(linenum, 4+lshift, err, errorcolor)
-      linenum += 2
-      if errorcounter is None:
-        errorcounter = 5
-        if height-linenum < len(choices):
-          topline += errorlen + 1
-          # if the error pushes hpos out of sight
-          if topline > hpos: topline = hpos
-      else:
-        errorcounter -= 1
-    # track the actual top line of the choices
-    actualtop = linenum
-    # i is zero indexed matching hpos
-    for i, line in enumerate(choices):
-      # we cannot go beyond height if choices is a long list
-      if linenum == height: break
-      # print this line
-      if i >= topline:
-        # set the color to active if this is our highlight position
-        color = activecolor if i == hpos else itemcolor
-        scr.insstr(linenum, 4+lshift, line, color)
-        linenum += 1
+      # the full draw may have moved topline to make room for an error
+      drawn = (topline, err, height, width)
+    prevhpos = hpos
     # set the cursor according to the argument and refresh the screen
     if curs != 0:
       cursorcol = 4 + lshift + len(choices[hpos])
       if cursorcol < width:
+        # the shown cursor is placed by the update
+        scr.leaveok(False)
         scr.move(actualtop + hpos - topline, cursorcol)
         curses.curs_set(curs)
-    scr.refresh()
+    # mark the menu for update and write it to the terminal once
+    scr.noutrefresh()
+    curses.doupdate()
     # get our response, reset the cursor and process the response
     ch = scr.getch()
     curses.curs_set(0)
+    scr.leaveok(True)
     # allow to return without making a selection:
     # escape = 27, 'Q'=81, 'q'=113
-    if ch in [27, 81, 113]: return None, None
+    if ch in quitkeys: return None, None
     # this argument indicates we return immediately on a keypress
     if infobox: return
-    # go to the top
-    elif ch == curses.KEY_HOME:
-      hpos = 0
-      topline = 0
-    # go to the bottom
-    elif ch == curses.KEY_END:
-      if actualtop + len(choices) > height:
-        topline = len(choices) - height + actualtop
-        hpos = len(choices) - 1
-    # go up
-    elif ch == curses.KEY_UP:
-      if hpos > 0:
-        hpos -= 1
-        if actualtop + hpos - topline < actualtop: topline -= 1
-    # go down
-    elif ch == curses.KEY_DOWN:
-      if hpos < len(choices) - 1:
-        hpos += 1
-        if actualtop + hpos - topline == height: topline += 1
-    # jump up
-    elif ch == curses.KEY_PPAGE and hpos > 0:
-      hpos -= 4
-      if hpos - topline < 0: topline = hpos
-      if hpos < 0:
-        hpos = 0
-        topline = 0
-    # jump down
-    elif ch == curses.KEY_NPAGE:
-      hpos += 4
-      if hpos >= len(choices) - 1: hpos = len(choices) - 1
-      if actualtop + hpos - topline >= height:
-        topline += actualtop + hpos - topline - height + 1
+    # move the highlight with the navigation keys
+    elif ch in menukeys:
+      hpos, topline = menukeys[ch](hpos, topline, actualtop,
+                                    height, nchoices)
     # on enter we return our highlighted position
-    elif ch in [curses.KEY_ENTER, 10, 13]: return topline, hpos
+    elif ch in enterkeys: return topline, hpos
+
+# the ascii control characters other than the whitespace in string.printable
+# a file with any of these is taken to be binary, C1 controls are allowed
+# as latin-1 decodes legacy (e.g., cp1252) punctuation to them
+controlchars = frozenset(map(chr, [*range(32), 127])) - frozenset(printable)
+
+'''
+decodetext(data)
+  Returns the bytes-like data decoded with the encoding open() uses
+  Data which isn't valid in that encoding is decoded as latin-1
+'''
+def decodetext(data):
+  try: return str(data, getpreferredencoding(False))
+  # latin-1 decodes any bytes, e.g., text saved in a legacy encoding
+  except UnicodeDecodeError: return str(data, 'latin-1')
+
+'''
+readfile(path)
+  Returns the text of the file at path, decoded by decodetext
+  The file is mapped and decoded straight from the mapping, this avoids
+  reading it into a buffer and copying it into a bytes object first
+'''
+def readfile(path):
+  with open(path, 'rb') as infile:
+    try: mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    # empty files and pipes can't be mapped, read them instead
+    except (ValueError, OSError): return decodetext(infile.read())
+    with mapped: return decodetext(mapped)
 
 '''
 filemenu(scr, title)
@@ -183,6 +278,7 @@ filemenu(scr, title)
   The navigation begins from the current working directory
   The choices are the contents of the currently selected directory
   A file opened must be a text file
+    the file is read at once and checked for unprintable characters
 
   Returns -> the file.readlines() list (or None if cancelled)
 '''
@@ -195,13 +291,13 @@ def filemenu(scr, title=''):
   ch = 0
   while True:
     # give an option to go up a level unless we are at the root
-    if path == '': path = '/'
     names = ['../'] if path != '/' else []
-    # add the contents of the directory
-    names += [name+'/' for name in os.listdir(path) \
-                        if os.path.isdir(path+'/'+name)]
-    names += [name for name in os.listdir(path) \
-                        if os.path.isfile(path+'/'+name)]
+    # add the contents of the directory, scandir gives the entry types
+    # without another stat of each path
+    with os.scandir(path) as entries:
+      for entry in entries:
+        if entry.is_dir(): names.append(entry.name+'/')
+        elif entry.is_file(): names.append(entry.name)
     names.sort()
     # get the response
     topline, ch = showmenu(scr, title=title, body=body, err=error,
@@ -213,15 +309,11 @@ def filemenu(scr, title=''):
     # if we selected to go up or our selection is a subdirectory
     if names[ch][-1] == '/':
       # if we chose to go up remove the last directory from the path
-      if names[ch] == '../':
-        path = '/'.join(path.split('/')[:-1])
-        # the root will become an empty string
-        if path == '': path = '/'
+      if names[ch] == '../': path = os.path.dirname(path)
       # we chose a directory from our path
       else:
         # test to see if we can get a list of the directory contents
-        names[ch] = names[ch][:-1]
-        testpath = path + names[ch] if path == '/' else path + '/' + names[ch]
+        testpath = os.path.join(path, names[ch][:-1])
         try: os.listdir(testpath)
         except Exception as e:
           # if we can't read the directory set an error string and continue
@@ -237,91 +329,447 @@ def filemenu(scr, title=''):
     else:
       # try to read the file
       try:
-        if path == '/': path = ''
         # reading the file will fail without permissions
         # or if the file is definitely not a text file
-        # (some binary files will pass here and throw an exception if used)
-        with open(path+'/'+names[ch]) as infile:
-          contents = infile.readlines()
-          if not contents:
-            error = 'File \"' + names[ch] + '\" appears empty'
-          for line in contents:
-            if any(c not in printable and not isinstance(c, str) for c in line):
-              error = 'File \"' + names[ch] + '\" not printable'
-              break
-          if not error: return contents, names[ch]
+        contents = readfile(os.path.join(path, names[ch]))
+        if not contents:
+          error = 'File \"' + names[ch] + '\" appears empty'
+        # unicode text is allowed, ascii control characters mean a binary file
+        elif not controlchars.isdisjoint(contents):
+          error = 'File \"' + names[ch] + '\" not printable'
+        # split only on newlines like readlines(), splitlines() also splits
+        # on form feeds and the unicode line separators
+        else:
+          return io.StringIO(contents, newline=None).readlines(), names[ch]
       except Exception as e:
         error = str(e).split(':')
 
 '''
-drawsplitpane(scr, lhs, lpos, rhs, rpos, highlight, paneshmt, halfgap)
+sliceview(lines, first, count, start, stop, cache)
+
+  This method returns the visible part of a pane as a list of strings
+  The strings are line[start:stop] of each line of lines[first:first+count]
+  cache is a dict holding the view returned by the previous call
+    while lines, start, and stop are unchanged the rows which are still
+    visible are reused and only the rows scrolled into view are sliced
+'''
+def sliceview(lines, first, count, start, stop, cache):
+  last = min(first + count, len(lines))
+  # the rows still visible from the previous view
+  lo, hi = first, first
+  if cache.get('lines') is lines and cache.get('cols') == (start, stop):
+    prev, view = cache['first'], cache['view']
+    lo, hi = max(first, prev), min(last, prev + len(view))
+  if lo < hi:
+    view = [line[start:stop] for line in lines[first:lo]] + \
+            view[lo-prev:hi-prev] + \
+            [line[start:stop] for line in lines[hi:last]]
+  else: view = [line[start:stop] for line in lines[first:last]]
+  cache['lines'], cache['cols'] = lines, (start, stop)
+  cache['first'], cache['view'] = first, view
+  return view
+
+'''
+shiftrow(scr, row, old, new, col, shift, width, color)
+
+  This method updates a row showing the string old to show the string new
+  The update is done when new is old with one character inserted (shift 1)
+    or removed (shift -1) at col, the rest of the row moves with insch/delch
+  Rows with non-ascii text are not shifted
+  Returns True if the row was updated, otherwise the row is unchanged
+'''
+def shiftrow(scr, row, old, new, col, shift, width, color):
+  # string indices are only screen columns for ascii text, and insch
+  # only takes a single byte character
+  if not (old.isascii() and new.isascii()): return False
+  if shift == 1 and col < len(new) and \
+        new == (old[:col] + new[col] + old[col:])[:width]:
+    scr.insch(row, col, new[col], color)
+    return True
+  if shift == -1 and col < len(old) and \
+        new.startswith(old[:col] + old[col+1:]):
+    scr.move(row, col)
+    scr.delch()
+    # text at the end of the row which moved into view
+    if len(new) > len(old) - 1:
+      scr.insstr(row, len(old) - 1, new[len(old)-1:], color)
+    return True
+  return False
+
+'''
+preplines(lines)
+  Returns the lines to display from a list of strings
+  Trailing whitespace and empty lines are removed, tabs become 2 spaces
+  The lines are interned so repeated lines share a single string
+'''
+def preplines(lines):
+  intern = sys.intern
+  # a line of only whitespace is empty after rstrip, one strip per line
+  return [intern(line.replace('\t','  ')) for line in map(str.rstrip, lines)
+                                              if line]
+
+'''
+alignlines(lhs, rhs, difflimit)
+
+  This method aligns the equal lines of lhs and rhs with a patience diff
+  Lines which occur once in both sides are anchors, the longest sequence
+    of anchors in the same order on both sides is aligned
+  The regions between the anchors are aligned the same way, when a region
+    has no anchors difflib's SequenceMatcher aligns it if both sides have
+    at most difflimit lines, larger regions without anchors are not aligned
+    (SequenceMatcher is roughly quadratic)
+  Equal lines at the start and end of each region are aligned first
+  Returns an array where the value at each lhs index is the aligned rhs index
+    or -1 when the lhs line is not aligned
+'''
+def alignlines(lhs, rhs, difflimit=300):
+  alignment = array('q', [-1]) * len(lhs)
+  # the regions left to align, (lhs start, lhs stop, rhs start, rhs stop)
+  regions = [(0, len(lhs), 0, len(rhs))]
+  while regions:
+    lstart, lstop, rstart, rstop = regions.pop()
+    # align the equal lines at the start and end of the region
+    while lstart < lstop and rstart < rstop and lhs[lstart] == rhs[rstart]:
+      alignment[lstart] = rstart
+      lstart += 1
+      rstart += 1
+    while lstart < lstop and rstart < rstop \
+                          and lhs[lstop-1] == rhs[rstop-1]:
+      lstop -= 1
+      rstop -= 1
+      alignment[lstop] = rstop
+    if lstart == lstop or rstart == rstop: continue
+    # the lines which occur once in both sides of the region
+    lcount = Counter(lhs[lstart:lstop])
+    rcount = Counter(rhs[rstart:rstop])
+    rindex = {line: j for j, line in enumerate(rhs[rstart:rstop], rstart)
+                        if rcount[line] == 1 and lcount[line] == 1}
+    pairs = [(i, rindex[line]) for i, line in enumerate(lhs[lstart:lstop],
+                                                        lstart)
+                                if line in rindex]
+    # without anchors fall back to difflib for this region if it is small
+    if not pairs:
+      if lstop - lstart > difflimit or rstop - rstart > difflimit: continue
+      matcher = SequenceMatcher(None, lhs[lstart:lstop], rhs[rstart:rstop],
+                                autojunk=False)
+      for i, j, n in matcher.get_matching_blocks():
+        alignment[lstart+i:lstart+i+n] = array('q', range(rstart+j,
+                                                          rstart+j+n))
+      continue
+    # the longest increasing sequence of rhs indices (patience sorting)
+    # tails[k] is the smallest rhs index ending a sequence of length k+1
+    tails, tailpairs, prev = [], [], []
+    for k, (i, j) in enumerate(pairs):
+      pile = bisect_left(tails, j)
+      prev.append(tailpairs[pile-1] if pile else -1)
+      if pile == len(tails):
+        tails.append(j)
+        tailpairs.append(k)
+      else:
+        tails[pile] = j
+        tailpairs[pile] = k
+    anchors = []
+    k = tailpairs[-1]
+    while k != -1:
+      anchors.append(pairs[k])
+      k = prev[k]
+    # align the anchors and add the regions between them, in reverse
+    for i, j in anchors:
+      alignment[i] = j
+      regions.append((i+1, lstop, j+1, rstop))
+      lstop, rstop = i, j
+    regions.append((lstart, lstop, rstart, rstop))
+  return alignment
+
+'''
+drawsplitpane(scr, lhs, lpos, rhs, rpos, highlight, paneshmt, halfgap, frame,
+              alignment, slicecache, size)
 
   This method draws a split pane view
   lhs and rhs are lists of strings
   lpos and rpos determines which row/col is the top left of each pane
+    (0, 0) shows the first line from its first column below the header
   The screen is divided vertically into 2 segments with a gap of halfgap*2
-  The screen is cleared, strings added to screen, then refreshed
+  Each row is built as a list of (col, text, color) segments
+    ascii lhs text and the rhs text on the same row in the default color
+    are joined into one
+  frame is a list holding the rows drawn by the previous call
+    only rows which differ from the previous frame are rewritten
+    when the pane separator moved by one column rows are shifted instead
+    when both panes moved by the same rows the rows are scrolled instead
+    rows which only changed color are updated with chgat
+    every row is rewritten when frame is empty or the dimensions changed
+  The screen is marked with noutrefresh, curses.doupdate() displays it
+  alignment is from alignlines of lhs and rhs with each line stripped
+    when highlight is set, rows showing aligned lines are highlighted
+    pass it to avoid aligning the lines on every call
+  slicecache is a dict used by sliceview to reuse the visible line slices
+  size is the (height, width) of scr, it is queried when size is None
   Returns the current height, width
 '''
-def drawsplitpane(scr, lhs, lpos, rhs, rpos, highlight, paneshmt=0, halfgap=2):
+def drawsplitpane(scr, lhs, lpos, rhs, rpos, highlight,
+                  paneshmt=0, halfgap=2, frame=None,
+                  alignment=None, slicecache=None, size=None):
+  # set colors to be used, attrs[match is True] is the color of a row
   infocolor = curses.color_pair(2) | curses.A_BOLD
-  # clear the screen
-  scr.erase()
+  attrs = (curses.color_pair(0), curses.color_pair(1) | curses.A_BOLD)
+  # the top left row/col of each pane
+  lrow, lcol = lpos
+  rrow, rcol = rpos
   # the current height and width (will change if window is resized)
-  height, width = scr.getmaxyx()
+  height, width = size if size is not None else scr.getmaxyx()
+  # the first entry of a frame is the dimensions it was drawn with,
+  # the width of the lhs pane, and the top rows of the lhs and rhs
+  if frame is None: frame = []
+  if not frame or frame[0][:2] != (height, width):
+    # forget the previous rows, every row is cleared with clrtoeol
+    # as it is rewritten instead of erasing the whole screen
+    frame[:] = [(height, width, None, None, None)] + [None]*height
+  # the rows of the new frame, row 0 is the header
+  rows = [[] for i in range(height)]
   # paneshmt can be negative or positive for left/right
   middle = width//2 + paneshmt
   # if the middle is shifted left or right
   if paneshmt != 0:
     # if the rhs was shifted out of view
     if middle >= width - halfgap:
-      scr.insstr(0, 1, 'left', infocolor)
+      rows[0].append((1, 'left', infocolor))
       rstart = width
-      lstop = width + lpos[1]
+      lstop = width + lcol
     # if the lhs was shifted out of view
     elif middle <= halfgap:
-      scr.insstr(0, width-6, 'right', infocolor)
+      rows[0].append((width-6, 'right', infocolor))
       rstart = 0
-      lstop = lpos[1]
+      lstop = lcol
     # otherwise the boundary is still in the middle
     else:
-      scr.insstr(0, 1, 'left', infocolor)
-      scr.insstr(0, width-6, 'right', infocolor)
+      rows[0].append((1, 'left', infocolor))
+      rows[0].append((width-6, 'right', infocolor))
       rstart = middle + halfgap
-      lstop = middle - halfgap + lpos[1]
+      lstop = middle - halfgap + lcol
   else:
     rstart = middle + halfgap
-    lstop = middle - halfgap + lpos[1]
-    scr.insstr(0, 1, 'left', infocolor)
-    scr.insstr(0, width-11, 'right', infocolor)
-  rstop = width - rstart + rpos[1]
-  # the default color is standard color
-  color = curses.color_pair(0)
-  # add lines
-  for i in range(1, height):
-    if highlight:
-      # if the strings match (without leading/trailing space)
-      if i+lpos[0] < len(lhs) and i+rpos[0] < len(rhs) and \
-            lhs[lpos[0]+i].strip() == rhs[rpos[0]+i].strip():
-        # make bold green
-        color = curses.color_pair(1) | curses.A_BOLD
-      # otherwise standard color
-      else: color = curses.color_pair(0)
+    lstop = middle - halfgap + lcol
+    rows[0].append((1, 'left', infocolor))
+    rows[0].append((width-11, 'right', infocolor))
+  rstop = width - rstart + rcol
+  # the visible text of each pane, lview[i-1] is row i
+  if slicecache is None: slicecache = {}
+  lview, rview = [], []
+  if lstop != lcol:
+    lview = sliceview(lhs, lrow, height-1, lcol, lstop,
+                      slicecache.setdefault('lhs', {}))
+  if rstop != rcol:
+    rview = sliceview(rhs, rrow, height-1, rcol, rstop,
+                      slicecache.setdefault('rhs', {}))
+  # the alignment of the stripped lines used to find matches
+  if highlight and alignment is None:
+    alignment = alignlines([line.strip() for line in lhs],
+                            [line.strip() for line in rhs])
+  # whether each visible row matches, the lhs line is aligned to the rhs line
+  # matches[i-1] is row i, rows past the end of lhs or rhs are not included
+  matches = []
+  if highlight:
+    matches = [aligned == row
+                for aligned, row in zip(alignment[lrow:lrow+height-1],
+                                        range(rrow,
+                                              min(len(rhs), rrow+height-1)))]
+  # add lines, the views are walked together and end with the longest
+  for i, (ltext, rtext, match) in enumerate(zip_longest(lview, rview, matches),
+                                            start=1):
+    # make matching strings bold green, otherwise standard color
+    # match is None past the end of lhs or rhs
+    color = attrs[match is True]
+    row = rows[i]
     # draw lhs if we have a row here
-    if lstop != lpos[1]:
-      if i+lpos[0] < len(lhs):
-        scr.insstr(i, 0, lhs[lpos[0]+i][lpos[1]:lstop], color)
-      elif i+lpos[0] == len(lhs):
-        scr.insstr(i, 1, 'END', infocolor)
+    if ltext is not None: row.append((0, ltext, color))
     # draw rhs if we have a row here
-    if rstop != rpos[1]:
-      if i+rpos[0] < len(rhs):
-        scr.insstr(i, rstart, rhs[rpos[0]+i][rpos[1]:rstop], color)
-      elif i+rpos[0] == len(rhs):
-        scr.insstr(i, width-4, 'END', infocolor)
-  scr.refresh()
+    if rtext is not None:
+      # when ascii lhs text is here, pad it to rstart and write a single
+      # string, other text may not take one cell per character
+      # highlighted rows keep two segments so the gap isn't highlighted
+      if row and color == attrs[0] and ltext.isascii():
+        row[0] = (0, ltext.ljust(rstart) + rtext, color)
+      else: row.append((rstart, rtext, color))
+  # the END markers go on the row after the last line of each pane
+  lend = len(lhs) - lrow + 1
+  if lstop != lcol and 1 <= lend < height:
+    # lhs segments come first in a row, they are inserted before rhs text
+    rows[lend].insert(0, (1, 'END', infocolor))
+  rend = len(rhs) - rrow + 1
+  if rstop != rcol and 1 <= rend < height:
+    rows[rend].append((width-4, 'END', infocolor))
+  # when the pane separator moved by one column the rows can be shifted
+  lcols = lstop - lcol
+  prevlcols, prevlrow, prevrrow = frame[0][2:]
+  shift = lcols - prevlcols if prevlcols is not None else 0
+  frame[0] = (height, width, lcols, lrow, rrow)
+  # when both panes moved by the same number of rows the rows below the
+  # header are scrolled, the previous rows are moved to match
+  # then only the rows scrolled into view differ from the previous frame
+  scrolled = lrow - prevlrow if prevlrow is not None else 0
+  if scrolled and not shift and scrolled == rrow - prevrrow and \
+        abs(scrolled) < height - 1:
+    scr.setscrreg(1, height-1)
+    try: scr.scroll(scrolled)
+    # scrolling needs scrollok, without it every changed row is rewritten
+    except curses.error: pass
+    else:
+      if scrolled > 0: frame[2:] = frame[2+scrolled:] + [None]*scrolled
+      else: frame[2:] = [None]*-scrolled + frame[2:scrolled]
+    # the whole window is the scrolling region again
+    finally: scr.setscrreg(0, height-1)
+  # rewrite only the rows which differ from the previous frame
+  # the window methods are bound once for the loop
+  move, clrtoeol, insstr = scr.move, scr.clrtoeol, scr.insstr
+  for i, row in enumerate(rows):
+    prev = frame[i+1]
+    if row == prev: continue
+    frame[i+1] = row
+    # rows with the same text in another color only change the attributes
+    # (e.g., toggling the highlight), this is limited to ascii text which
+    # fills one cell per character
+    if prev and len(row) == len(prev) and \
+          all(seg[:2] == old[:2] and seg[1].isascii()
+              for seg, old in zip(row, prev)):
+      for col, text, attr in row: scr.chgat(i, col, len(text), attr)
+      continue
+    # rows of a single segment in the same color may only need a shift
+    if shift in (-1, 1) and len(row) == 1 and prev and len(prev) == 1 and \
+          row[0][0] == prev[0][0] == 0 and row[0][2] == prev[0][2] and \
+          shiftrow(scr, i, prev[0][1], row[0][1], min(lcols, lcols-shift),
+                    shift, width, row[0][2]):
+      continue
+    move(i, 0)
+    clrtoeol()
+    for col, text, attr in row: insstr(i, col, text, attr)
+  # mark for update, the caller flushes with curses.doupdate()
+  scr.noutrefresh()
   return height, width
 
+'''
+DiffState(llen, rlen, lwidth, rwidth, height, width)
+
+  The state of the diff view shown by DiffWindow.showdiff
+  llen/rlen and lwidth/rwidth are the line count and max width of lhs/rhs
+  height and width are the last known dimensions of the screen
+  lrow, lcol and rrow, rcol are the top left row, col of the lhs and rhs
+
+  view returns the values used to draw, showdiff repaints when they change
+  The remaining methods are the key handlers used by showdiff
+  Each handler updates the state for a single keypress
+'''
+class DiffState:
+  def __init__(self, llen, rlen, lwidth, rwidth, height, width):
+    self.llen, self.rlen = llen, rlen
+    self.lwidth, self.rwidth = lwidth, rwidth
+    # track the last known height/width as the window could be resized
+    self.height, self.width = height, width
+    # track top left 'coordinate' of the text in the lists
+    # the starting row + col to display of the lhs and rhs
+    self.lrow, self.lcol = 0, 0
+    self.rrow, self.rcol = 0, 0
+    # allow independent scrolling
+    self.singlescroll = False
+    # side toggle for independent scrolling
+    self.leftscroll = True
+    # whether the lhs / rhs scroll, updated when the above are toggled
+    self.lscroll, self.rscroll = True, True
+    # toggle for whether to highlight matching lines
+    self.highlight = True
+    # shift amount for pane boundary, division between lhs/rhs views
+    self.paneshmt = 0
+
+  # the values which determine what drawsplitpane draws
+  def view(self):
+    return (self.lrow, self.lcol, self.rrow, self.rcol,
+            self.highlight, self.paneshmt)
+
+  # the space key to toggle independent scrolling
+  def togglelock(self):
+    self.singlescroll = not self.singlescroll
+    self.lscroll, self.rscroll = (self.leftscroll, not self.leftscroll) \
+                                  if self.singlescroll else (True, True)
+
+  # the tab key to toggle whether lhs is active (otherwise rhs)
+  def toggleside(self):
+    self.leftscroll = not self.leftscroll
+    self.lscroll, self.rscroll = (self.leftscroll, not self.leftscroll) \
+                                  if self.singlescroll else (True, True)
+
+  # toggle line match highlight with d, D, h, or H (for diff/highlight)
+  def togglehighlight(self): self.highlight = not self.highlight
+
+  # plus key to shift pane separator right
+  def shiftright(self):
+    if self.width//2 + self.paneshmt < self.width - 2: self.paneshmt += 1
+
+  # minus key to shift pane separator left
+  def shiftleft(self):
+    if self.width//2 + self.paneshmt > 2: self.paneshmt -= 1
+
+  # equal key to reset pane shift
+  def resetshift(self): self.paneshmt = 0
+
+  # reset positions
+  def home(self):
+    if self.lscroll: self.lrow = 0
+    if self.rscroll: self.rrow = 0
+
+  # go to the bottom
+  def end(self):
+    # fit our maxheight in the last known height
+    if self.lscroll and self.height < self.llen:
+      self.lrow = self.llen - self.height + 2
+    if self.rscroll and self.height < self.rlen:
+      self.rrow = self.rlen - self.height + 2
+
+  # page up
+  def pageup(self):
+    if self.lscroll:
+      self.lrow -= self.height - 4
+      if self.lrow < 0: self.lrow = 0
+    if self.rscroll:
+      self.rrow -= self.height - 4
+      if self.rrow < 0: self.rrow = 0
+
+  # page down
+  def pagedown(self):
+    if self.lscroll and self.height < self.llen:
+      self.lrow += self.height - 4
+      if self.lrow > self.llen - self.height + 1:
+        self.lrow = self.llen - self.height + 2
+    if self.rscroll and self.height < self.rlen:
+      self.rrow += self.height - 4
+      if self.rrow > self.rlen - self.height + 1:
+        self.rrow = self.rlen - self.height + 2
+
+  # scroll up
+  def up(self):
+    if self.lscroll and self.lrow > 0: self.lrow -= 1
+    if self.rscroll and self.rrow > 0: self.rrow -= 1
+
+  # scroll down
+  def down(self):
+    if self.lscroll and self.height - 2 < self.llen:
+      if self.lrow < self.llen - self.height + 2: self.lrow += 1
+    if self.rscroll and self.height - 2 < self.rlen:
+      if self.rrow < self.rlen - self.height + 2: self.rrow += 1
+
+  # scroll left
+  def left(self):
+    if self.lscroll and self.lcol > 0: self.lcol -= 1
+    if self.rscroll and self.rcol > 0: self.rcol -= 1
+
+  # scroll right
+  def right(self):
+    middle = self.width//2 + self.paneshmt
+    if self.lscroll and middle > 2:
+      if self.lwidth - self.lcol > middle - 2: self.lcol += 1
+    if self.rscroll and middle < self.width:
+      if self.rwidth - self.rcol > self.width - middle - 2:
+        self.rcol += 1
+
 '''
   DiffWindow
   ___________
@@ -357,7 +805,7 @@ def drawsplitpane(scr, lhs, lpos, rhs, rpos, highlight, paneshmt=0, halfgap=2):
   The '=' key will reset the pane shift
   The keys d, D, h, or H toggle match highlighting
     (d for diff, h for highlight)
-  When highlighting is enabled lhs/rhs lines that are the same
+  When highlighting is enabled lhs/rhs lines that are aligned by the diff
     **and are on the same level of the screen**
     will be highlighted
 '''
@@ -369,7 +817,30 @@ class DiffWindow:
     Set unsafe flag to allow usage without enter/exit
     The intended usage is as described above and in the "if name == __main__"
   '''
-  def __init__(self, unsafe=False): self.unsafe = unsafe
+  def __init__(self, unsafe=False):
+    self.unsafe = unsafe
+    # whether curses is initialized, None until initscr is first called
+    self.havescr = None
+    # the diff view key handlers, looked up by the key pressed
+    self.diffkeys = {32: DiffState.togglelock,
+                     9: DiffState.toggleside,
+                     68: DiffState.togglehighlight,
+                     72: DiffState.togglehighlight,
+                     100: DiffState.togglehighlight,
+                     104: DiffState.togglehighlight,
+                     43: DiffState.shiftright,
+                     45: DiffState.shiftleft,
+                     61: DiffState.resetshift,
+                     curses.KEY_HOME: DiffState.home,
+                     curses.KEY_END: DiffState.end,
+                     curses.KEY_PPAGE: DiffState.pageup,
+                     curses.KEY_NPAGE: DiffState.pagedown,
+                     curses.KEY_UP: DiffState.up,
+                     curses.KEY_DOWN: DiffState.down,
+                     curses.KEY_LEFT: DiffState.left,
+                     curses.KEY_RIGHT: DiffState.right}
+    # the last lists given to showdiff and their preprocessed lines
+    self.prepared = None
 
   '''
   __enter__
@@ -392,9 +863,7 @@ class DiffWindow:
     Ensure curses has been town down
   '''
   def __del__(self):
-    try:
-      if self.havescr: self.stopscr()
-    except AttributeError: pass
+    if self.havescr: self.stopscr()
 
   '''
   initscr
@@ -403,9 +872,7 @@ class DiffWindow:
   '''
   def initscr(self):
     # flag init
-    try:
-      if self.havescr: return
-    except AttributeError: pass
+    if self.havescr: return
     self.havescr = True
     # get the std screen
     self.stdscr = curses.initscr()
@@ -425,10 +892,17 @@ class DiffWindow:
     curses.cbreak()
     # hide the cursor
     curses.curs_set(0)
+    # the cursor is hidden, don't move it to the last write after updates
+    self.stdscr.leaveok(True)
     # enable to cursor to go out of bounds
     self.stdscr.scrollok(True)
+    # allow the terminal's line insert/delete when scrolling the diff view
+    self.stdscr.idlok(True)
     # enable use of curses info for curses.KEY_LEFT, etc.
     self.stdscr.keypad(True)
+    # getch blocks until a key is pressed, no polling while idle
+    # (showdiff only uses nodelay while reading keys already queued)
+    self.stdscr.timeout(-1)
     return self
 
   '''
@@ -438,136 +912,86 @@ class DiffWindow:
   '''
   def stopscr(self):
     # reset modes back to normal
-    try:
-      if self.havescr:
-        self.havescr = False
-        curses.nocbreak()
-        self.stdscr.keypad(False)
-        curses.echo()
-        curses.endwin()
-    except AttributeError: pass
+    if self.havescr:
+      self.havescr = False
+      curses.nocbreak()
+      self.stdscr.keypad(False)
+      curses.echo()
+      curses.endwin()
 
   '''
   showdiff(lhs, rhs)
 
     This is the main driver function for the file diff display
     Takes 2 lists of strings, lhs and rhs
+    The preprocessed lines are kept, so showing the same lists again
+      (e.g., from the main menu) skips the preprocessing
 
     Returns when the escape, q, or Q key has been pressed
   '''
   def showdiff(self, lhs=[], rhs=[]):
     # confirm class usage
-    try:
-      if not self.havescr: self.initscr()
-    except AttributeError:
-      if self.unsafe: self.initscr()
-      else:
+    if not self.havescr:
+      if self.havescr is None and not self.unsafe:
         raise AssertionError('unsafe is not true and curses not initialized')
+      self.initscr()
     # remove empty lines, trailing whitespace, and tabs from lhs / rhs
-    lhs = [re.sub('\t','  ',line.rstrip()) for line in lhs \
-                                              if line.strip() != '']
-    rhs = [re.sub('\t','  ',line.rstrip()) for line in rhs \
-                                              if line.strip() != '']
-    # get column length for lhs and rhs (max of any element)
-    self.lwidth = 0
-    for row in lhs: self.lwidth = max(len(row),self.lwidth)
-    self.rwidth = 0
-    for row in rhs: self.rwidth = max(len(row),self.rwidth)
-    # track top left 'coordinate' of the text in the lists
-    # the l/rpos is the starting row + col to display
-    lpos = [0,0] # lpos[0] is starting row
-    rpos = [0,0] # rpos[1] is starting col
-    # track the last known height/width as the window could be resized
-    lastheight, lastwidth = self.stdscr.getmaxyx()
-    # allow independent scrolling
-    singlescroll = False
-    # side toggle for independent scrolling
-    leftscroll = True
-    scroll = lambda x: not singlescroll or leftscroll if x=='left' \
-                    else not singlescroll or not leftscroll
-    # toggle for whether to highlight matching lines
-    highlight = True
-    # shift amount for pane boundary, division between lhs/rhs views
-    paneshmt = 0
-    # these chars will quit: escape = 27, 'Q'=81, 'q'=113
-    # we'll start at home
-    ch = curses.KEY_HOME
-    while ch not in [27, 81, 113]:
-      middle = lastwidth//2 + paneshmt
-      # repaint the screen if we do one of these conditions
-      repaint = True
-      # the space key to toggle independent scrolling
-      if ch == 32: singlescroll = not singlescroll
-      # the tab key to toggle whether lhs is active (otherwise rhs)
-      elif ch == 9: leftscroll = not leftscroll
-      # toggle line match highlight with d, D, h, or H (for diff/highlight)
-      elif ch in [68, 72, 100, 104]: highlight = not highlight
-      # plus key to shift pane separator right
-      elif ch == 43:
-        if middle < lastwidth - 2: paneshmt += 1
-      # minus key to shift pane separator left
-      elif ch == 45:
-        if middle > 2: paneshmt -= 1
-      # equal key to reset pane shift
-      elif ch == 61: paneshmt = 0
-      # reset positions
-      elif ch == curses.KEY_HOME:
-        if scroll('left'): lpos[0] = -1
-        if scroll('right'): rpos[0] = -1
-      # go to the bottom
-      elif ch == curses.KEY_END:
-        # fit our maxheight in the last known height
-        if scroll('left') and lastheight < len(lhs):
-          lpos[0] = len(lhs) - lastheight + 1
-        if scroll('right') and lastheight < len(rhs):
-          rpos[0] = len(rhs) - lastheight + 1
-      # page up
-      elif ch == curses.KEY_PPAGE:
-        if scroll('left'):
-          lpos[0] -= lastheight - 4
-          if lpos[0] < 0: lpos[0] = -1
-        if scroll('right'):
-          rpos[0] -= lastheight - 4
-          if rpos[0] < 0: rpos[0] = -1
-      # page down
-      elif ch == curses.KEY_NPAGE:
-        if scroll('left') and lastheight < len(lhs):
-          lpos[0] += lastheight - 4
-          if lpos[0] > len(lhs) - lastheight:
-            lpos[0] = len(lhs) - lastheight + 1
-        if scroll('right') and lastheight < len(rhs):
-          rpos[0] += lastheight - 4
-          if rpos[0] > len(rhs) - lastheight:
-            rpos[0] = len(rhs) - lastheight + 1
-      # scroll up
-      elif ch == curses.KEY_UP:
-        if scroll('left') and lpos[0] >= 0: lpos[0] -= 1
-        if scroll('right') and rpos[0] >= 0: rpos[0] -= 1
-      # scroll down
-      elif ch == curses.KEY_DOWN:
-        if scroll('left') and lastheight - 2 < len(lhs):
-          if lpos[0] < len(lhs) - lastheight + 1: lpos[0] += 1
-        if scroll('right') and lastheight - 2 < len(rhs):
-          if rpos[0] < len(rhs) - lastheight + 1: rpos[0] += 1
-      # scroll left
-      elif ch == curses.KEY_LEFT:
-        if scroll('left') and lpos[1] > 0:
-          lpos[1] -= 1
-        if scroll('right') and rpos[1] > 0:
-          rpos[1] -= 1
-      # scroll right
-      elif ch == curses.KEY_RIGHT:
-        if scroll('left') and middle > 2:
-          if self.lwidth - lpos[1] > middle - 2: lpos[1] += 1
-        if scroll('right') and middle < lastwidth:
-          if self.rwidth - rpos[1] > lastwidth - middle - 2: rpos[1] += 1
-      # if we didn't change the pos then don't repaint
-      else: repaint = False
-      if repaint:
-        lastheight, lastwidth = drawsplitpane(self.stdscr,
-                                              lhs, lpos, rhs, rpos,
-                                              highlight, paneshmt)
-      ch = self.stdscr.getch()
+    if self.prepared is None or self.prepared[0] is not lhs \
+                              or self.prepared[1] is not rhs:
+      lprep, rprep = preplines(lhs), preplines(rhs)
+      # the stripped lines are aligned once for highlighting
+      # equal interned lines are the same object, compared by identity
+      intern = sys.intern
+      # get column length for lhs and rhs (max of any element)
+      self.prepared = (lhs, rhs, lprep, rprep,
+                        alignlines([intern(line.strip()) for line in lprep],
+                                    [intern(line.strip()) for line in rprep]),
+                        max(map(len, lprep), default=0),
+                        max(map(len, rprep), default=0))
+    lhs, rhs, alignment, self.lwidth, self.rwidth = self.prepared[2:]
+    # the screen size is only queried again after a KEY_RESIZE
+    size = self.stdscr.getmaxyx()
+    # the state of the view which is changed by keypresses
+    state = DiffState(len(lhs), len(rhs), self.lwidth, self.rwidth, *size)
+    # the rows drawn on the screen, used to only repaint changed rows
+    self.prevframe = []
+    # the visible slices of lhs and rhs, reused while scrolling
+    self.slicecache = {}
+    # the view last drawn and the screen size it was drawn at
+    drawn = None
+    # the methods used for every keypress are bound once
+    getch, gethandler = self.stdscr.getch, self.diffkeys.get
+    # the view starts at the top of both files, the quitkeys will return
+    while True:
+      # repaint when the keys changed the view or the screen was resized
+      view = (state.view(), size)
+      if view != drawn:
+        drawn = view
+        state.height, state.width = drawsplitpane(self.stdscr,
+                                              lhs, (state.lrow, state.lcol),
+                                              rhs, (state.rrow, state.rcol),
+                                              state.highlight, state.paneshmt,
+                                              frame=self.prevframe,
+                                              alignment=alignment,
+                                              slicecache=self.slicecache,
+                                              size=size)
+      # write the pending updates to the terminal once
+      curses.doupdate()
+      # apply this key and the keys already waiting (e.g., a held arrow key)
+      # the view is drawn once after all of them
+      ch = getch()
+      self.stdscr.nodelay(True)
+      while ch != -1 and ch not in quitkeys:
+        # keys without a handler don't change the view
+        handler = gethandler(ch)
+        if handler is not None: handler(state)
+        elif ch == curses.KEY_RESIZE:
+          # keep curses.LINES and curses.COLS in step with the new size
+          curses.update_lines_cols()
+          size = self.stdscr.getmaxyx()
+        ch = getch()
+      self.stdscr.nodelay(False)
+      if ch in quitkeys: return
 
   '''
   commands()
@@ -593,12 +1017,10 @@ class DiffWindow:
   '''
   def mainmenu(self):
     # confirm class usage
-    try:
-      if not self.havescr: self.initscr()
-    except AttributeError:
-      if self.unsafe: self.initscr()
-      else:
+    if not self.havescr:
+      if self.havescr is None and not self.unsafe:
         raise AssertionError('unsafe is not true and curses not initialized')
+      self.initscr()
     # the title for each window
     title = 'DiffWindow - a Python curses script to compare 2 text files'
     # the body text
@@ -687,9 +1109,13 @@ __name__ == __main__
 '''
 if __name__ == '__main__':
   if len(sys.argv) == 3:
-    lhs, rhs = [], []
-    with open(sys.argv[1]) as infile: lhs = infile.readlines()
-    with open(sys.argv[2]) as infile: rhs = infile.readlines()
+    texts = [readfile(path) for path in sys.argv[1:]]
+    # binary files are rejected as in filemenu, before curses is started
+    for path, text in zip(sys.argv[1:], texts):
+      if not controlchars.isdisjoint(text):
+        sys.exit('File \"' + path + '\" not printable')
+    # split only on newlines, as filemenu does
+    lhs, rhs = [io.StringIO(text, newline=None).readlines() for text in texts]
     with DiffWindow() as win: win.showdiff(lhs, rhs)
   else:
     with DiffWindow() as win: win.mainmenu()